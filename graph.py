@@ -1,9 +1,21 @@
+import numpy as np
 import pandas as pd
 import networkx as nx
+import pyarrow as pa
+import pyarrow.compute as pc
 import os
 from pyvis.network import Network
 
-def plot_trader_bubblemap(df, output_html="bubblemap.html", base_dir=None):
+# Graphs with more nodes than this are pre-laid out in Python and rendered with physics disabled
+PHYSICS_NODE_LIMIT = 300
+
+
+def _to_usd(values):
+    """Coerce a column of USD amounts (floats or comma-formatted strings) to floats, NaN when unparseable."""
+    return pd.to_numeric(values.astype(str).str.replace(',', '', regex=False), errors='coerce')
+
+
+def plot_trader_bubblemap(edges_df, nodes_df=None, output_html=None, base_dir=None):
 
     """This function creates an interactive bubble map visualization of trader relationships.
 
@@ -11,111 +23,154 @@ def plot_trader_bubblemap(df, output_html="bubblemap.html", base_dir=None):
     and edges represent trading relationships between them. Node sizes are scaled
     based on the total USD trading volume of each address, and node colors are set
     to orange for high-volume traders (above the median volume) and blue for
-    low-volume traders (below the median). The visualization is saved as an HTML file
-    using PyVis and can be displayed in a browser or embedded in a Streamlit app.
+    low-volume traders (below the median). The visualization is rendered to HTML in memory
+    using PyVis and can be embedded in a Streamlit app or optionally saved to a file.
 
     Args:
-        df (pandas.DataFrame): A DataFrame containing trader relationship data with the
-            following columns:
-            - type (str): Either 'node' or 'edge', indicating the type of data.
-            - address (str): The trader's wallet address (for nodes and edges).
-            - target_address (str): The connected address (for edges).
-            - total_usd_traded (float): The USD trading volume for the node or edge.
-        output_html (str, optional): Filename for the HTML visualization. Defaults to "bubblemap.html".
+        edges_df (pandas.DataFrame): A DataFrame containing the 'edge' rows of the trader
+            relationship data with the following columns:
+            - address (str): The trader's wallet address.
+            - target_address (str): The connected address.
+            - total_usd_traded (float): The USD trading volume for the edge.
+        nodes_df (pandas.DataFrame, optional): The 'node' rows of the same query result, with
+            `address` and `total_usd_traded` columns. When given, these per-trader volumes are
+            used for node sizes and colors; otherwise volumes are summed from the edges.
+        output_html (str, optional): Filename to also save the HTML visualization to. If None
+            (the default), nothing is written to disk.
         base_dir (str, optional): Base directory to save the HTML file. If None, uses current directory.
 
     Returns:
-        None
+        str: The rendered HTML document.
 
     Notes:
         - The function expects `total_usd_traded` to be a numerical value (float).
           If it contains formatted strings (e.g., with commas), it attempts to convert
           them to floats, with a fallback weight of 1 if conversion fails.
-        - Nodes with missing `address` or `target_address` are removed from the DataFrame.
+        - Edges with missing `address` or `target_address` are removed from the DataFrame.
         - Node sizes are scaled linearly between 10 and 50 based on their total USD trading
           volume.
         - The color threshold is the median volume across all nodes: nodes above the median
           are orange (#FF4500), and nodes below are blue (#1E90FF).
-        - The visualization uses the Force Atlas 2 layout algorithm for node positioning.
+        - The visualization uses the Force Atlas 2 layout algorithm for node positioning. Graphs
+          with more than PHYSICS_NODE_LIMIT nodes are instead positioned up front with a seeded
+          NetworkX spring layout and rendered with physics disabled, which keeps large graphs responsive.
         - A message is printed indicating the number of nodes and edges in the graph.
     """
 
 
     # Removing rows where address or target_address is missing
-    df = df.dropna(subset=['address', 'target_address'])
-
-    # Calculating total volume per address (node)
-    # Suming total_usd_traded for each address appearing as 'address' or 'target_address'
-    volume_from = df.groupby('address')['total_usd_traded'].sum()
-    volume_to = df.groupby('target_address')['total_usd_traded'].sum()
-    total_volume = volume_from.add(volume_to, fill_value=0).to_dict()
-
-    # Creating empty graph
-    G = nx.Graph()
-
-    # Adding nodes
-    nodes = pd.unique(df[['address', 'target_address']].values.ravel())
-    nodes = [node for node in nodes if pd.notna(node)]  # Remove NaNs
-
-    for node in nodes:
-        G.add_node(node)
+    df = edges_df.dropna(subset=['address', 'target_address'])
+    df = df.astype({'address': 'string[pyarrow]', 'target_address': 'string[pyarrow]'})
 
-    # Adding edges
-    for idx, row in df.iterrows():
-        from_addr = row['address']
-        to_addr = row['target_address']
+    # Coercing total_usd_traded to floats once; unparseable values fall back to a weight of 1 on the edges
+    usd = _to_usd(df['total_usd_traded'])
+    weights = usd.fillna(1.0)
 
-        try:
-            weight = float(str(row['total_usd_traded']).replace(',', ''))
-        except:
-            weight = 1  # Fallback
-
-        G.add_edge(from_addr, to_addr, weight=weight)
+    # Calculating total volume per address (node)
+    if nodes_df is not None:
+        # Using the per-trader volumes the query already computed in its 'node' rows
+        total_volume = _to_usd(nodes_df['total_usd_traded']).groupby(nodes_df['address'].values, sort=False).sum()
+    else:
+        # Suming total_usd_traded for each address appearing as 'address' or 'target_address'
+        # (both columns are stacked so a single groupby covers both sides of every edge)
+        stacked = pd.DataFrame({
+            'addr': np.concatenate([df['address'].values, df['target_address'].values]),
+            'usd': np.concatenate([usd.values, usd.values])
+        })
+        total_volume = stacked.groupby('addr', sort=False)['usd'].sum()
+
+    # Collecting unique node ids with Arrow's hash kernel (dropna above already removed missing addresses)
+    nodes = pc.unique(
+        pa.chunked_array([pa.array(df['address']), pa.array(df['target_address'])])
+    ).to_numpy(zero_copy_only=False)
+
+    # Collecting edges; the graph is undirected, so repeated or reversed pairs
+    # collapse into a single edge carrying the last weight seen
+    edges = pd.DataFrame({
+        'source': df['address'].values,
+        'target': df['target_address'].values,
+        'weight': weights.values
+    })
+    reversed_pair = edges['source'] > edges['target']
+    pair_keys = pd.DataFrame({
+        'low': edges['source'].where(~reversed_pair, edges['target']),
+        'high': edges['target'].where(~reversed_pair, edges['source'])
+    })
+    edges = edges[~pair_keys.duplicated(keep='last')]
 
     # Building Pyvis network
     net = Network(height="800px", width="100%", bgcolor="#222222", font_color="white", notebook=True, cdn_resources='in_line')
 
-    # Determining node sizes and colors based on total volume
-    volumes = [total_volume.get(node, 0) for node in G.nodes()]
-    if volumes:
-        min_volume = min(volumes)
-        max_volume = max(volumes)
-        volume_range = max_volume - min_volume if max_volume != min_volume else 1
-
+    # Determining node sizes and colors based on total volume, aligned to the node order
+    volumes = total_volume.reindex(nodes, fill_value=0).to_numpy(dtype=np.float64)
+    if volumes.size:
         # Defining size scaling (e.g., map volumes to sizes between 10 and 50)
         min_size = 10
         max_size = 50
-        sizes = [
-            min_size + (max_size - min_size) * (total_volume.get(node, 0) - min_volume) / volume_range
-            for node in G.nodes()
-        ]
+        volume_range = np.ptp(volumes) or 1  # Avoiding division by zero when all volumes are equal
+        sizes = min_size + (max_size - min_size) * (volumes - volumes.min()) / volume_range
 
         # Defining color threshold (e.g., median volume as the cutoff for "large" vs "small")
-        threshold = pd.Series(volumes).median()
-        colors = ["#FF4500" if total_volume.get(node, 0) >= threshold else "#1E90FF" for node in G.nodes()]  # Orange for large, Blue for small
+        threshold = np.median(volumes)
+        colors = np.where(volumes >= threshold, "#FF4500", "#1E90FF")  # Orange for large, Blue for small
     else:
-        sizes = [10 for _ in G.nodes()]  # Default size if no volumes
-        colors = ["#1E90FF" for _ in G.nodes()]  # Default to blue
-
-    # Adding nodes with sizes and colors
-    for node, size, color in zip(G.nodes(), sizes, colors):
-        net.add_node(node, label=node[:6] + "..." + node[-4:], title=f"{node}\nVolume: ${total_volume.get(node, 0):,.2f}", size=size, color=color)
-
-    # Adding edges
-    for edge in G.edges(data=True):
-        net.add_edge(edge[0], edge[1], value=edge[2]['weight'])
+        sizes = np.full(len(nodes), 10.0)  # Default size if no volumes
+        colors = np.full(len(nodes), "#1E90FF")  # Default to blue
+
+    # Preparing node labels and hover titles
+    node_ids = pd.Series(nodes)
+    labels = (node_ids.str.slice(0, 6) + "..." + node_ids.str.slice(-4)).tolist()
+    titles = (node_ids + "\nVolume: $" + pd.Series(volumes).map("{:,.2f}".format)).tolist()
+    positions = {}
+    use_physics = len(nodes) <= PHYSICS_NODE_LIMIT
+    if not use_physics:
+        # Pre-positioning nodes so the browser doesn't have to run the physics simulation
+        G = nx.Graph()
+        G.add_nodes_from(nodes)
+        G.add_edges_from(zip(edges['source'].values, edges['target'].values))
+        layout = nx.spring_layout(G, seed=42, iterations=50)
+        coords = np.array([layout[node] for node in nodes]) * 1000
+        positions = {'x': coords[:, 0].tolist(), 'y': coords[:, 1].tolist()}
+
+    # Building the node payload directly instead of calling add_node per node; ids are already
+    # unique, so PyVis' per-call membership check is unnecessary. Mirrors pyvis.node.Node's options.
+    node_font = dict(color=net.font_color)
+    net.nodes = [
+        {'id': node, 'label': label, 'shape': 'dot', 'title': title, 'size': size, 'color': color, 'font': node_font}
+        for node, label, title, size, color in zip(nodes.tolist(), labels, titles, sizes.tolist(), colors.tolist())
+    ]
+    if positions:
+        for node_options, x, y in zip(net.nodes, positions['x'], positions['y']):
+            node_options.update(x=x, y=y)
+    net.node_ids = [node_options['id'] for node_options in net.nodes]
+    net.node_map = {node_options['id']: node_options for node_options in net.nodes}
+
+    # Building the edge payload directly as well; edges were deduplicated above, which makes
+    # add_edge's linear scan for an existing edge (quadratic overall) redundant
+    sources = edges['source'].to_numpy(dtype=object)
+    targets = edges['target'].to_numpy(dtype=object)
+    edge_weights = edges['weight'].to_numpy(dtype=np.float64).tolist()  # Python floats in one pass
+    net.edges = [
+        {'from': source, 'to': target, 'value': weight}
+        for source, target, weight in zip(sources, targets, edge_weights)
+    ]
 
     print(f"Graph will be built with {len(nodes)} nodes and {len(df)} edges")
 
-    # Ensuring the output path includes the base directory
-    if base_dir:
-        os.makedirs(base_dir, exist_ok=True)  # Creating the directory if it doesn't exist
-        output_path = os.path.join(base_dir, output_html)
-    else:
-        output_path = output_html
-
     # Visualize
     net.force_atlas_2based()
-    net.show(output_path)
-
-    return output_path  # Return the path for use in Streamlit
+    if not use_physics:
+        net.toggle_physics(False)
+    html = net.generate_html(notebook=False)
+
+    # Saving to disk only when an output file is requested
+    if output_html:
+        if base_dir:
+            os.makedirs(base_dir, exist_ok=True)  # Creating the directory if it doesn't exist
+            output_path = os.path.join(base_dir, output_html)
+        else:
+            output_path = output_html
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+
+    return html  # Return the HTML for use in Streamlit
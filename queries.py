@@ -1,3 +1,78 @@
+from datetime import date, timedelta
+
+# Labelled addresses excluded from the top traders (exchanges, pools, bots and other infrastructure)
+EXCLUDED_LABEL_TYPES = ('cex', 'dex', 'defi', 'bridge', 'contract', 'treasury', 'infrastructure')
+EXCLUDED_LABEL_SUBTYPES = (
+    'pool', 'router', 'exchange', 'mev_bot', 'flash_loan', 'vault',
+    'wrapper', 'burn_address', 'null_address'
+)
+EXCLUDED_NAME_PATTERNS = (
+    '%pool%', '%bot%', '%mev%', '%vault%', '%treasury%',
+    '%wrapper%', '%flash%loan%', '%token%account%', '%amm%'
+)
+
+
+def _sql_literal(value):
+    """Render a Python value as a Snowflake SQL literal (strings are quoted and escaped)."""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, date):
+        value = value.isoformat()
+    value = str(value).replace('\\', '\\\\').replace("'", "''")
+    return f"'{value}'"
+
+
+def _to_date(value):
+    """Coerce a date, datetime or YYYY-MM-DD string to a `datetime.date`."""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip())
+
+
+def _bad_labels_cte(labels_table, label_types, label_subtypes):
+    """
+    Build the `bad_labels` CTE listing the labelled addresses to exclude.
+
+    The label lookup is restricted to addresses that appear in `swap_transactions`, so the
+    LIKE ANY scan over `address_name` only runs for traders of the token in range.
+    """
+    def sql_list(values):
+        return ', '.join(f"'{value}'" for value in values)
+
+    return f"""    bad_labels AS (
+        SELECT DISTINCT
+            address
+        FROM {labels_table}
+        WHERE address IN (SELECT trader FROM swap_transactions)
+            AND (
+                label_type IN ({sql_list(label_types)})
+                OR label_subtype IN ({sql_list(label_subtypes)})
+                OR LOWER(address_name) LIKE ANY ({sql_list(EXCLUDED_NAME_PATTERNS)})
+            )
+    ),"""
+
+
+def _bind_params(sql, params):
+    """
+    Substitute each `?` placeholder in `sql` with the matching entry of `params`.
+
+    The Flipside SDK only accepts a SQL string, so binding happens client-side; user inputs
+    never reach the query text unescaped and only validated identifiers (the chain) are
+    interpolated directly.
+    """
+    parts = sql.split('?')
+    if len(parts) - 1 != len(params):
+        raise ValueError(f"Expected {len(parts) - 1} query parameters, got {len(params)}")
+
+    bound = [parts[0]]
+    for value, part in zip(params, parts[1:]):
+        bound.append(_sql_literal(value))
+        bound.append(part)
+    return ''.join(bound)
+
+
 
 
 def get_evm_traders_and_connections(chain, contract_address, start_date, end_date, min_usd_amount=1, max_usd_amount=100000000, min_active_days=3, limit=200):
@@ -13,6 +88,9 @@ def get_evm_traders_and_connections(chain, contract_address, start_date, end_dat
     max_usd_amount (float): Maximum USD amount for trades to be considered
     min_active_days (int): Minimum number of different days with trading activity
     limit (int): Number of top traders to return
+
+    The query returns a single row whose `payload` column is an object with a `nodes` array
+    (one entry per top trader) and an `edges` array (one entry per connected pair).
     """
     print("📦 Preparing query for:")
     print(f"🔗 Chain: {chain}")
@@ -29,121 +107,129 @@ def get_evm_traders_and_connections(chain, contract_address, start_date, end_dat
     if chain not in valid_chains:
         raise ValueError(f"Chain must be one of {valid_chains}")
 
+    # Normalizing inputs client-side so the warehouse sees plain literals it can prune on
+    token = contract_address.strip().lower()
+    end_date_exclusive = _to_date(end_date) + timedelta(days=1)
+
+    bad_labels = _bad_labels_cte(f'{chain}.core.dim_labels', EXCLUDED_LABEL_TYPES, EXCLUDED_LABEL_SUBTYPES)
+
     evm_query = f"""
-    WITH swap_transactions AS (
+    WITH raw_swaps AS (
         SELECT
             block_timestamp,
             tx_hash,
             sender as trader,
             COALESCE(amount_in_usd, 0) + COALESCE(amount_out_usd, 0) as amount_usd,
             CASE
-                WHEN token_in = LOWER(TRIM('{contract_address}')) THEN amount_in
-                WHEN token_out = LOWER(TRIM('{contract_address}')) THEN amount_out
+                WHEN token_in = ? THEN amount_in
+                WHEN token_out = ? THEN amount_out
             END as token_amount
         FROM {chain}.defi.ez_dex_swaps
-        WHERE (token_in = LOWER(TRIM('{contract_address}')) OR token_out = LOWER(TRIM('{contract_address}')))
-            AND block_timestamp >= '{start_date}'
-            AND block_timestamp < DATEADD(day, 1, '{end_date}')::date
-            AND COALESCE(amount_in_usd, 0) + COALESCE(amount_out_usd, 0) >= {min_usd_amount}
-            AND COALESCE(amount_in_usd, 0) + COALESCE(amount_out_usd, 0) <= {max_usd_amount}
+        WHERE (token_in = ? OR token_out = ?)
+            AND block_timestamp >= ?
+            AND block_timestamp < ?
     ),
 
-    filtered_traders AS (
-        SELECT DISTINCT
-            trader as address
-        FROM swap_transactions
-        WHERE trader NOT IN (
-            SELECT address
-            FROM {chain}.core.dim_labels
-            WHERE label_type IN (
-                'cex', 'dex', 'defi', 'bridge', 'contract', 'treasury', 'infrastructure'
-            )
-            OR label_subtype IN (
-                'pool', 'router', 'exchange', 'mev_bot', 'flash_loan', 'vault',
-                'wrapper', 'burn_address', 'null_address'
-            )
-            OR LOWER(address_name) LIKE ANY (
-                '%pool%', '%bot%', '%mev%', '%vault%', '%treasury%',
-                '%wrapper%', '%flash%loan%', '%token%account%', '%amm%'
-            )
-            LIMIT 1000
-        )
+    swap_transactions AS (
+        SELECT *
+        FROM raw_swaps
+        WHERE amount_usd BETWEEN ? AND ?
+    ),
+
+{bad_labels}
+
+    clean_swaps AS (
+        SELECT s.*
+        FROM swap_transactions s
+        LEFT JOIN bad_labels b ON s.trader = b.address
+        WHERE b.address IS NULL
     ),
 
-    trading_patterns AS (
+    trader_stats AS (
         SELECT
             trader as address,
             COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) as active_days,
-            COUNT(DISTINCT tx_hash) as total_trades,
-            COUNT(DISTINCT tx_hash)::FLOAT / COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) as avg_daily_trades,
-            SUM(amount_usd) as total_volume
-        FROM swap_transactions
-        WHERE trader IN (SELECT address FROM filtered_traders)
+            COUNT(DISTINCT tx_hash) as trade_count,
+            SUM(ABS(token_amount)) as total_tokens_traded,
+            SUM(amount_usd) as total_usd_traded,
+            COUNT(DISTINCT tx_hash)::FLOAT / NULLIF(COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)), 0) as avg_daily_trades
+        FROM clean_swaps
         GROUP BY trader
         HAVING
-            COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) >= {min_active_days}
-            AND COUNT(DISTINCT tx_hash) >= 5
+            active_days >= ?
+            AND trade_count >= 5
+            AND total_usd_traded > 0
+        QUALIFY ROW_NUMBER() OVER (ORDER BY total_usd_traded DESC) <= ?
     ),
 
-    top_traders AS (
+    trader_tx AS (
         SELECT
-            s.trader as address,
-            COUNT(DISTINCT s.tx_hash) as trade_count,
-            SUM(ABS(s.token_amount)) as total_tokens_traded,
-            SUM(s.amount_usd) as total_usd_traded,
-            tp.active_days,
-            tp.avg_daily_trades
-        FROM swap_transactions s
-        JOIN trading_patterns tp ON s.trader = tp.address
-        WHERE s.trader IN (SELECT address FROM filtered_traders)
-        GROUP BY s.trader, tp.active_days, tp.avg_daily_trades
-        HAVING total_usd_traded > 0
-        QUALIFY ROW_NUMBER() OVER (ORDER BY total_usd_traded DESC) <= {limit}
+            tx_hash,
+            trader,
+            SUM(ABS(token_amount)) as tokens,
+            SUM(amount_usd) as usd
+        FROM clean_swaps
+        WHERE trader IN (SELECT address FROM trader_stats)
+        GROUP BY tx_hash, trader
+    ),
+
+    tx_groups AS (
+        SELECT
+            tx_hash,
+            ARRAY_AGG(OBJECT_CONSTRUCT('trader', trader, 'tokens', tokens, 'usd', usd))
+                WITHIN GROUP (ORDER BY trader) as traders
+        FROM trader_tx
+        GROUP BY tx_hash
+        HAVING COUNT(*) >= 2
     ),
 
     connections AS (
         SELECT
-            s1.trader as source,
-            s2.trader as target,
-            COUNT(DISTINCT s1.tx_hash) as transaction_count,
-            SUM(ABS(s1.token_amount)) as total_tokens,
-            SUM(s1.amount_usd) as total_value
-        FROM swap_transactions s1
-        JOIN swap_transactions s2
-            ON s1.tx_hash = s2.tx_hash
-            AND s1.trader < s2.trader
-        WHERE s1.trader IN (SELECT address FROM top_traders)
-            AND s2.trader IN (SELECT address FROM top_traders)
-        GROUP BY s1.trader, s2.trader
+            i.value:trader::string as source,
+            j.value:trader::string as target,
+            COUNT(DISTINCT g.tx_hash) as transaction_count,
+            SUM(i.value:tokens::float) as total_tokens,
+            SUM(i.value:usd::float) as total_value
+        FROM tx_groups g,
+            LATERAL FLATTEN(input => g.traders) i,
+            LATERAL FLATTEN(input => g.traders) j
+        WHERE i.index < j.index
+        GROUP BY source, target
         HAVING total_value > 0
     )
 
-    SELECT
-        'node' as type,
-        address,
-        NULL as target_address,
-        TO_NUMBER(trade_count) as trade_count,
-        TO_NUMBER(total_tokens_traded) as total_tokens_traded,
-        TO_NUMBER(total_usd_traded) as total_usd_traded,
-        TO_NUMBER(active_days) as active_days,
-        TO_NUMBER(ROUND(avg_daily_trades, 2)) as avg_daily_trades
-    FROM top_traders
-
-    UNION ALL
-
-    SELECT
-        'edge' as type,
-        source as address,
-        target as target_address,
-        TO_NUMBER(transaction_count) as trade_count,
-        TO_NUMBER(total_tokens) as total_tokens_traded,
-        TO_NUMBER(total_value) as total_usd_traded,
-        NULL as active_days,
-        NULL as avg_daily_trades
-    FROM connections
-    ORDER BY type, total_usd_traded DESC;
+    SELECT OBJECT_CONSTRUCT_KEEP_NULL(
+        'nodes', (
+            SELECT ARRAY_AGG(OBJECT_CONSTRUCT_KEEP_NULL(
+                'address', address,
+                'trade_count', TO_NUMBER(trade_count),
+                'total_tokens_traded', TO_NUMBER(total_tokens_traded),
+                'total_usd_traded', TO_NUMBER(total_usd_traded),
+                'active_days', TO_NUMBER(active_days),
+                'avg_daily_trades', TO_NUMBER(ROUND(avg_daily_trades, 2))
+            )) WITHIN GROUP (ORDER BY total_usd_traded DESC)
+            FROM trader_stats
+        ),
+        'edges', (
+            SELECT ARRAY_AGG(OBJECT_CONSTRUCT_KEEP_NULL(
+                'address', source,
+                'target_address', target,
+                'trade_count', TO_NUMBER(transaction_count),
+                'total_tokens_traded', TO_NUMBER(total_tokens),
+                'total_usd_traded', TO_NUMBER(total_value)
+            )) WITHIN GROUP (ORDER BY total_value DESC)
+            FROM connections
+        )
+    ) as payload;
     """
-    return evm_query
+    params = [
+        token, token, token, token,
+        start_date, end_date_exclusive,
+        min_usd_amount, max_usd_amount,
+        min_active_days,
+        limit
+    ]
+    return _bind_params(evm_query, params)
 
 
 def get_solana_traders_and_connections(contract_address, start_date, end_date, min_usd_amount=1, max_usd_amount=100000000, min_active_days=3, limit=200):
@@ -159,6 +245,9 @@ def get_solana_traders_and_connections(contract_address, start_date, end_date, m
     max_usd_amount (float): Maximum USD amount for trades to be considered
     min_active_days (int): Minimum number of different days with trading activity
     limit (int): Number of top traders to return
+
+    The query returns a single row whose `payload` column is an object with a `nodes` array
+    (one entry per top trader) and an `edges` array (one entry per transfer pair).
     """
     print("📦 Preparing query for:")
     print(f"🪙 Contract Address: {contract_address}")
@@ -168,8 +257,17 @@ def get_solana_traders_and_connections(contract_address, start_date, end_date, m
     print(f"🏆 Top Traders Limit: {limit}")
     print("-" * 60)
 
+    # Solana mint addresses are case-sensitive, so they are only trimmed
+    mint = contract_address.strip()
+
+    bad_labels = _bad_labels_cte(
+        'solana.core.dim_labels',
+        EXCLUDED_LABEL_TYPES + ('token',),
+        EXCLUDED_LABEL_SUBTYPES + ('token_account',)
+    )
+
     sol_query = f"""
-    WITH swap_transactions AS (
+    WITH raw_swaps AS (
     SELECT
         block_timestamp,
         swapper as trader,
@@ -177,111 +275,93 @@ def get_solana_traders_and_connections(contract_address, start_date, end_date, m
         COALESCE(swap_from_amount_usd, 0) + COALESCE(swap_to_amount_usd, 0) as amount_usd,
         tx_id
     FROM solana.defi.ez_dex_swaps
-    WHERE (swap_from_mint = '{contract_address}' OR swap_to_mint = '{contract_address}')
-        AND block_timestamp BETWEEN '{start_date}' AND '{end_date}'
-        AND COALESCE(swap_from_amount_usd, 0) + COALESCE(swap_to_amount_usd, 0) >= {min_usd_amount}
-        AND COALESCE(swap_from_amount_usd, 0) + COALESCE(swap_to_amount_usd, 0) <= {max_usd_amount}
+    WHERE (swap_from_mint = ? OR swap_to_mint = ?)
+        AND block_timestamp BETWEEN ? AND ?
     ),
 
-    trading_patterns AS (
-        SELECT
-            trader,
-            COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) as active_days,
-            COUNT(DISTINCT tx_id) as total_trades,
-            COUNT(DISTINCT tx_id) / COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) as avg_daily_trades,
-            SUM(amount_usd) as total_volume
-        FROM swap_transactions
-        GROUP BY trader
-        HAVING
-            COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) >= {min_active_days}
-            AND COUNT(DISTINCT tx_id) >= 5
+    swap_transactions AS (
+        SELECT *
+        FROM raw_swaps
+        WHERE amount_usd BETWEEN ? AND ?
     ),
 
-    filtered_traders AS (
-        SELECT DISTINCT
-            tp.trader as address
-        FROM trading_patterns tp
-        WHERE tp.trader NOT IN (
-            SELECT DISTINCT l.address
-            FROM solana.core.dim_labels l
-            WHERE label_type IN (
-                'cex', 'dex', 'defi', 'bridge', 'contract', 'treasury', 'infrastructure', 'token'
-            )
-            OR label_subtype IN (
-                'pool', 'router', 'exchange', 'mev_bot', 'flash_loan', 'vault',
-                'wrapper', 'burn_address', 'null_address', 'token_account'
-            )
-            OR LOWER(address_name) LIKE ANY (
-                '%pool%', '%bot%', '%mev%', '%vault%', '%treasury%',
-                '%wrapper%', '%flash%loan%', '%token%account%', '%amm%'
-            )
-            LIMIT 1000
-        )
+{bad_labels}
+
+    clean_swaps AS (
+        SELECT s.*
+        FROM swap_transactions s
+        LEFT JOIN bad_labels b ON s.trader = b.address
+        WHERE b.address IS NULL
     ),
 
     trader_nodes AS (
         SELECT
-            'node' as type,
-            st.trader as address,
-            NULL as target_address,
-            COUNT(DISTINCT st.tx_id) as trade_count,
-            SUM(st.token_amount) as total_tokens_traded,
-            SUM(st.amount_usd) as total_usd_traded,
-            tp.active_days,
-            tp.avg_daily_trades
-        FROM swap_transactions st
-        JOIN trading_patterns tp ON st.trader = tp.trader
-        WHERE st.trader IN (SELECT address FROM filtered_traders)
-        GROUP BY st.trader, tp.active_days, tp.avg_daily_trades
+            trader as address,
+            COUNT(DISTINCT tx_id) as trade_count,
+            SUM(token_amount) as total_tokens_traded,
+            SUM(amount_usd) as total_usd_traded,
+            COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)) as active_days,
+            COUNT(DISTINCT tx_id) / NULLIF(COUNT(DISTINCT DATE_TRUNC('day', block_timestamp)), 0) as avg_daily_trades
+        FROM clean_swaps
+        GROUP BY trader
+        HAVING
+            active_days >= ?
+            AND trade_count >= 5
         ORDER BY total_usd_traded DESC
-        LIMIT {limit}
+        LIMIT ?
     ),
 
     transfers_between_traders AS (
         SELECT
-            'edge' as type,
             tx_from as address,
             tx_to as target_address,
             COUNT(DISTINCT tx_id) as trade_count,
             SUM(amount) as total_tokens_traded,
-            SUM(amount * COALESCE(p.price, 0)) as total_usd_traded,
-            NULL as active_days,
-            NULL as avg_daily_trades
+            SUM(amount * COALESCE(p.price, 0)) as total_usd_traded
         FROM solana.core.fact_transfers ft
         LEFT JOIN solana.price.ez_prices_hourly p
-            ON p.token_address = '{contract_address}'
+            ON p.token_address = ?
             AND DATE_TRUNC('hour', ft.block_timestamp) = p.hour
-        WHERE ft.block_timestamp BETWEEN '{start_date}' AND '{end_date}'
-        AND ft.mint = '{contract_address}'
+        WHERE ft.block_timestamp BETWEEN ? AND ?
+        AND ft.mint = ?
         AND ft.tx_from IN (SELECT address FROM trader_nodes)
         AND ft.tx_to IN (SELECT address FROM trader_nodes)
         GROUP BY tx_from, tx_to
         HAVING SUM(amount) > 0
     )
 
-    SELECT
-        type,
-        address,
-        target_address,
-        trade_count,
-        TO_NUMBER(total_tokens_traded) as total_tokens_traded,
-        TO_NUMBER(total_usd_traded) as total_usd_traded,
-        active_days,
-        ROUND(avg_daily_trades, 2) as avg_daily_trades
-    FROM trader_nodes
-
-    UNION ALL
-
-    SELECT
-        type,
-        address,
-        target_address,
-        trade_count,
-        TO_NUMBER(total_tokens_traded) as total_tokens_traded,
-        TO_NUMBER(total_usd_traded) as total_usd_traded,
-        active_days,
-        avg_daily_trades
-    FROM transfers_between_traders
-    ORDER BY type, total_usd_traded DESC;
+    SELECT OBJECT_CONSTRUCT_KEEP_NULL(
+        'nodes', (
+            SELECT ARRAY_AGG(OBJECT_CONSTRUCT_KEEP_NULL(
+                'address', address,
+                'trade_count', trade_count,
+                'total_tokens_traded', TO_NUMBER(total_tokens_traded),
+                'total_usd_traded', TO_NUMBER(total_usd_traded),
+                'active_days', active_days,
+                'avg_daily_trades', ROUND(avg_daily_trades, 2)
+            )) WITHIN GROUP (ORDER BY total_usd_traded DESC)
+            FROM trader_nodes
+        ),
+        'edges', (
+            SELECT ARRAY_AGG(OBJECT_CONSTRUCT_KEEP_NULL(
+                'address', address,
+                'target_address', target_address,
+                'trade_count', trade_count,
+                'total_tokens_traded', TO_NUMBER(total_tokens_traded),
+                'total_usd_traded', TO_NUMBER(total_usd_traded)
+            )) WITHIN GROUP (ORDER BY total_usd_traded DESC)
+            FROM transfers_between_traders
+        )
+    ) as payload;
     """
-    return sol_query
+    params = [
+        mint, mint,
+        start_date, end_date,
+        min_usd_amount, max_usd_amount,
+        min_active_days,
+        limit,
+        mint,
+        start_date, end_date,
+        mint
+    ]
+    return _bind_params(sol_query, params)
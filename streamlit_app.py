@@ -1,4 +1,6 @@
 import os
+import json
+import hashlib
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
@@ -7,11 +9,64 @@ from queries import *
 from graph import plot_trader_bubblemap
 from datetime import date, datetime
 
-# Load API key
-load_dotenv()
-api_key = os.getenv("FS_API_KEY")
-print(f"API Key loaded: {'Yes' if api_key else 'No'}")
-flipside = Flipside(api_key, "https://api-v2.flipsidecrypto.xyz")
+NODE_COLUMNS = ["address", "trade_count", "total_tokens_traded", "total_usd_traded", "active_days", "avg_daily_trades"]
+EDGE_COLUMNS = ["address", "target_address", "trade_count", "total_tokens_traded", "total_usd_traded"]
+
+
+@st.cache_resource
+def get_flipside():
+    """Create the Flipside client once per server process so its HTTP session is reused across reruns."""
+    # Load API key
+    load_dotenv()
+    api_key = os.getenv("FS_API_KEY")
+    print(f"API Key loaded: {'Yes' if api_key else 'No'}")
+    return Flipside(api_key, "https://api-v2.flipsidecrypto.xyz")
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_query(chain, contract_address, start_date, end_date, min_usd, max_usd, min_days, limit):
+    """Build and run the Flipside query for the given inputs and return its (nodes, edges) frames, memoized per parameter tuple."""
+    if chain.lower() == "solana":
+        query = get_solana_traders_and_connections(
+            contract_address,
+            start_date,
+            end_date,
+            min_usd_amount=min_usd,
+            max_usd_amount=max_usd,
+            min_active_days=min_days,
+            limit=limit
+        )
+    else:
+        query = get_evm_traders_and_connections(
+            chain.lower(),
+            contract_address,
+            start_date,
+            end_date,
+            min_usd_amount=min_usd,
+            max_usd_amount=max_usd,
+            min_active_days=min_days,
+            limit=limit
+        )
+
+    flipside = get_flipside()
+    result = flipside.query(query)
+
+    # The query returns a single row holding a {nodes: [...], edges: [...]} payload
+    records = result.records or []
+    payload = records[0]["payload"] if records else None
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    payload = payload or {}
+
+    nodes_df = pd.DataFrame(payload.get("nodes") or [], columns=NODE_COLUMNS)
+    edges_df = pd.DataFrame(payload.get("edges") or [], columns=EDGE_COLUMNS)
+    return nodes_df, edges_df
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def render_bubblemap(df_hash_key, _edges_df, _nodes_df):
+    """Render the bubblemap HTML for the edge/node frames, memoized on their content hash (the frames themselves are not hashed)."""
+    return plot_trader_bubblemap(_edges_df, _nodes_df)
 
 # Streamlit UI
 st.title("Top Traders Bubblemap Tool")
@@ -54,50 +109,21 @@ if st.button("Run Analysis"):
     elif min_usd > max_usd:
         st.error("Minimum USD Volume must be less than Maximum USD Volume.")
     else:
-        if chain.lower() == "solana":
-            query = get_solana_traders_and_connections(
-                contract_address,
-                start_date,
-                end_date,
-                min_usd_amount=min_usd,
-                max_usd_amount=max_usd,
-                min_active_days=min_days,
-                limit=limit
-            )
-        else:
-            query = get_evm_traders_and_connections(
-                chain.lower(),
-                contract_address,
-                start_date,
-                end_date,
-                min_usd_amount=min_usd,
-                max_usd_amount=max_usd,
-                min_active_days=min_days,
-                limit=limit
-            )
-
         st.info("⏳ This might take a few seconds depending on the chain and date range...")
 
         with st.spinner("Querying Flipside..."):
             try:
-                result = flipside.query(query)
-                df = pd.DataFrame(result.records)
+                nodes_df, edges_df = run_query(chain, contract_address, start_date, end_date, min_usd, max_usd, min_days, limit)
 
-                if df.empty:
+                if nodes_df.empty and edges_df.empty:
                     st.warning("No data found for the given inputs.")
                 else:
                     st.subheader("Connections Between Top Traders")
 
-                    # Filter only edge rows
-                    edges_df = df[df["type"] == "edge"].copy()
-
-                    # Format numeric fields
+                    # Keep numeric fields as floats so sorting is numeric; formatting is applied at render time
                     edges_df["total_usd_traded"] = pd.to_numeric(edges_df["total_usd_traded"], errors="coerce")
                     edges_df["total_tokens_traded"] = pd.to_numeric(edges_df["total_tokens_traded"], errors="coerce")
 
-                    edges_df["total_usd_traded"] = edges_df["total_usd_traded"].map(lambda x: f"${x:,.2f}" if pd.notnull(x) else "")
-                    edges_df["total_tokens_traded"] = edges_df["total_tokens_traded"].map(lambda x: f"{x:,.2f}" if pd.notnull(x) else "")
-
                     edges_df = edges_df.sort_values("total_usd_traded", ascending=False)
 
                     st.dataframe(
@@ -109,15 +135,17 @@ if st.button("Run Analysis"):
                             "trade_count": "Trades",
                             "total_tokens_traded": "Tokens",
                             "total_usd_traded": "USD Volume"
-                        })
+                        }).style.format({"USD Volume": "${:,.2f}", "Tokens": "{:,.2f}"}, na_rep="")
                     )
 
                     # Plot bubblemap
                     st.subheader("Bubblemap Visualization")
-                    html_path = plot_trader_bubblemap(df)
-                    with open(html_path, 'r', encoding='utf-8') as f:
-                        html = f.read()
-                        st.components.v1.html(html, height=600, width=1200, scrolling=True)
+                    df_hash = hashlib.sha1()
+                    for frame in (edges_df, nodes_df):
+                        df_hash.update(pd.util.hash_pandas_object(frame).values)
+                    df_hash_key = df_hash.hexdigest()
+                    html = render_bubblemap(df_hash_key, edges_df, nodes_df)
+                    st.components.v1.html(html, height=600, width=1200, scrolling=True)
 
             except Exception as e:
                 st.error(f"Error running query or connecting to API: {e}")